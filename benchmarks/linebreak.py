@@ -0,0 +1,63 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+from linebreak import ENGINES
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+    'tempor incididunt ut labore et dolore magna aliqua ut enim ad minim '
+    'veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea '
+    'commodo consequat'
+).split()
+
+
+def paragraph(words, font, size, seed):
+    rng = random.Random(seed)
+    return [stringWidth(rng.choice(WORDS), font, size) for _ in range(words)]
+
+
+def quality(widths, space, width, breaks):
+    raggedness = 0
+    overfull = 0
+    for start, end in breaks[:-1]:
+        natural = sum(widths[start:end]) + space * (end - start - 1)
+        raggedness += (width - natural) ** 2
+        overfull += natural > width
+    return raggedness / max(len(breaks) - 1, 1), overfull
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare line breaking engines')
+    parser.add_argument('--words', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--width', type=float, default=450)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    font, size = 'Helvetica', 12
+    space = stringWidth(' ', font, size)
+    print('{:>8} {:>10} {:>12} {:>8} {:>14} {:>9}'.format(
+        'words', 'engine', 'time, ms', 'lines', 'raggedness', 'overfull'
+    ))
+    for words in args.words:
+        widths = paragraph(words, font, size, seed=words)
+        for name, engine in ENGINES.items():
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                breaks = engine(widths, space, args.width)
+                timings.append(time.perf_counter() - started)
+            print('{:>8} {:>10} {:>12.3f} {:>8} {:>14.1f} {:>9}'.format(
+                words, name, min(timings) * 1000, len(breaks),
+                *quality(widths, space, args.width, breaks)
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+    'tempor incididunt ut labore et dolore magna aliqua ut enim ad minim '
+    'veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea '
+    'commodo consequat'
+).split()
+BORDER = '-' * 20
+WORDS_PER_PAGE = 500
+
+STAGES = {
+    'parse': ('intro parse', 'body parse'),
+    'execute': ('intro execute', 'body execute'),
+    'layout': ('layout',),
+    'write': ('draw', 'save'),
+}
+
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def paragraphs(rng, count, length=100):
+    return '\n'.join(words(rng, length) + '.' for _ in range(count))
+
+
+def plain(size, rng):
+    intro = 'size(11)'
+    return intro, paragraphs(rng, size * WORDS_PER_PAGE // 100)
+
+
+def macros(size, rng, depth=20):
+    intro = ['level0 = function(t) { output(t) }']
+    for level in range(1, depth + 1):
+        intro.append('level{} = function(t) {{ level{}(t) }}'.format(level, level - 1))
+    body = []
+    for _ in range(size * WORDS_PER_PAGE // 50):
+        body.append('{} [level{}[{}]] '.format(words(rng, 40), depth, words(rng, 10)))
+    return '\n'.join(intro), '\n'.join(body)
+
+
+def columns(size, rng):
+    intro = 'size(10)'
+    body = []
+    for _ in range(size):
+        body.append('[columns(({"width"=200}, {}, {"align"="right"}))][column(1)]')
+        for column in range(1, 4):
+            if column > 1:
+                body.append('[column({})]'.format(column))
+            body.append(paragraphs(rng, 1, WORDS_PER_PAGE // 3))
+        body.append('[columns(({}))][column(1)]')
+    return intro, '\n'.join(body)
+
+
+def inline(size, rng):
+    intro = 'font("Helvetica", 11)'
+    body = []
+    for _ in range(size * WORDS_PER_PAGE // 20):
+        style = rng.choice(('i', 'tt'))
+        body.append('{} [{}[{}]]'.format(words(rng, 15), style, words(rng, 5)))
+    return intro, '\n'.join(body)
+
+
+def font_switches(size, rng):
+    intro = '\n'.join([
+        'sans = function(t) { font("Helvetica", 11); output(t) }',
+        'serif = function(t) { font("Times-Roman", 12); output(t) }',
+        'mono = function(t) { font("Courier", 10); output(t) }',
+    ])
+    body = []
+    for _ in range(size * WORDS_PER_PAGE // 10):
+        body.append('[{}[{} ]]'.format(rng.choice(('sans', 'serif', 'mono')), words(rng, 10)))
+    return intro, ''.join(body)
+
+
+SHAPES = {
+    'plain': plain,
+    'macros': macros,
+    'columns': columns,
+    'inline': inline,
+    'fonts': font_switches,
+}
+
+
+def run(file, stream):
+    from doc import Document
+    from press import read_source
+    from profiler import Profiler
+
+    profiler = Profiler()
+    profiler.install()
+    started = time.perf_counter()
+    try:
+        doc = Document(file, stream=stream)
+        intro, text = read_source(file)
+        doc.init(intro)
+        doc.render(text)
+        doc.save()
+    finally:
+        profiler.uninstall()
+    total = time.perf_counter() - started
+    phases = profiler.results()['phases']
+    result = {
+        stage: sum(phases.get(name, 0.0) for name in names)
+        for stage, names in STAGES.items()
+    }
+    result['total'] = total
+    return result
+
+
+def benchmark(shapes, size, repeat, stream):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in shapes:
+            intro, body = SHAPES[name](size, random.Random(name))
+            file = os.path.join(tmp, '{}.press'.format(name))
+            with open(file, 'w') as f:
+                f.write('{}\n{}\n{}\n'.format(intro, BORDER, body))
+            runs = [run(file, stream) for _ in range(repeat)]
+            results[name] = {stage: min(r[stage] for r in runs) for stage in runs[0]}
+            print_row(name, results[name])
+    return results
+
+
+def print_header():
+    print('{:<10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'shape', *(stage + ', ms' for stage in list(STAGES) + ['total'])
+    ))
+
+
+def print_row(name, result):
+    print('{:<10} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+        name, *(result[stage] * 1000 for stage in list(STAGES) + ['total'])
+    ))
+
+
+def compare(baseline, results, threshold):
+    regressions = 0
+    print()
+    print('{:<10} {:<8} {:>10} {:>10} {:>8}'.format('shape', 'stage', 'before', 'after', 'ratio'))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for stage, elapsed in result.items():
+            before = baseline[name].get(stage)
+            if not before:
+                continue
+            ratio = elapsed / before
+            flag = ''
+            if ratio > threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print('{:<10} {:<8} {:>10.2f} {:>10.2f} {:>8.2f}{}'.format(
+                name, stage, before * 1000, elapsed * 1000, ratio, flag
+            ))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every pipeline stage on synthetic documents')
+    parser.add_argument('--shapes', nargs='+', choices=list(SHAPES), default=list(SHAPES))
+    parser.add_argument('--size', type=int, default=10, help='pages of text per document')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the parse and font disk caches enabled')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.1,
+                        help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    if not args.cache:
+        os.environ['PRESS_CACHE'] = '0'
+
+    print_header()
+    results = benchmark(args.shapes, args.size, args.repeat, args.stream)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'size': args.size, 'stream': args.stream, 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import pickle
+
+CACHE_DIR = os.environ.get(
+    'PRESS_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'press')
+)
+
+
+def file_digest(*files):
+    digest = hashlib.sha256()
+    for file in files:
+        with open(file, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class DiskCache:
+    def __init__(self, name, fingerprint='', max_size=64 * 1024 * 1024):
+        self.path = os.path.join(CACHE_DIR, name)
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+        self.enabled = os.environ.get('PRESS_CACHE', '1') != '0'
+
+    def key(self, *parts):
+        digest = hashlib.sha256(self.fingerprint.encode('utf-8'))
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            digest.update(part)
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        file = os.path.join(self.path, key)
+        try:
+            with open(file, 'rb') as f:
+                value = pickle.load(f)
+            # mtime doubles as the last access time for eviction
+            os.utime(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        return value
+
+    def set(self, key, value, evict=True):
+        if not self.enabled:
+            return
+        file = os.path.join(self.path, key)
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError, TypeError, AttributeError):
+            return
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            tmp = '{}.{}.tmp'.format(file, os.getpid())
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, file)
+        except OSError:
+            return
+        if evict:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if entry.name.endswith('.tmp'):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        except OSError:
+            return
+        entries.sort()
+        for _, size, file in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,61 @@
+from reportlab.lib.rl_accel import fp_str
+from reportlab.pdfbase import pdfmetrics
+
+
+class TextRecorder:
+    # Stands in for PDFTextObject during layout: the calls are recorded as
+    # plain tuples and the vertical position is tracked the same way,
+    # including how consecutive moves are merged, so getY() paginates
+    # exactly like the text object would.
+
+    def __init__(self, font, size, leading):
+        self.ops = []
+        self._fontname = font
+        self._fontsize = size
+        self._leading = leading
+        # beginText() starts at the origin, that is not an operation
+        self._y0 = self._y = 0
+        self._move = None
+
+    def setTextOrigin(self, x, y):
+        self.ops.append(('origin', x, y))
+        self._y0 = self._y = y
+        self._move = None
+
+    def setFont(self, psfontname, size, leading=None):
+        self.ops.append(('font', psfontname, size, leading))
+        self._fontname = psfontname
+        self._fontsize = size
+        if leading is None:
+            leading = size * 1.2
+        self._leading = leading
+        # embedded fonts switch inline with the text, standard fonts write
+        # an operator that ends the merging of moves
+        if not pdfmetrics.getFont(psfontname)._dynamicFont:
+            self._move = None
+
+    def moveCursor(self, dx, dy):
+        self.ops.append(('move', dx, dy))
+        if self._move is not None:
+            last_dx, last_dy = self._move
+            dx += last_dx
+            dy -= last_dy
+            self._y0 -= last_dy
+        self._move = tuple(float(value) for value in fp_str(dx, -dy).split())
+        self._y0 += dy
+        self._y = self._y0
+
+    def setXPos(self, dx):
+        self.moveCursor(dx, 0)
+
+    def textLine(self, text=''):
+        self.ops.append(('line', text))
+        self._y = self._y0 = self._y - self._leading
+        self._move = None
+
+    def textOut(self, text):
+        self.ops.append(('out', text))
+        self._move = None
+
+    def getY(self):
+        return self._y
@@ -1,20 +1,48 @@
 import os
 
+from reportlab import rl_config
 from reportlab.lib.units import cm
 from reportlab.pdfgen.canvas import Canvas
 import reportlab.lib.pagesizes
 from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 
+import fonts
+import paragraphs
+import pdf
+import profiler
+import tracing
+from display import TextRecorder
 from runtime import Runtime
-from parsers import press_lang, template
+from text_fragment import Coalescer, PageBreak
+from parsers import press_lang, scan
+from parsers.cache import parse as cached_parse
 from parsers.ast import press_lang as press_lang_ast
 from parsers.ast import template as template_ast
 
+# PDF writing trade-offs. reportlab always embeds subsets of TrueType
+# fonts, so profiles only differ in how page and font streams are stored.
+PROFILES = {
+    'default': {},
+    # streams left uncompressed, cheapest to write
+    'fast': {'pageCompression': 0},
+    # compressed streams stored as binary rather than ASCII85 text
+    'small': {'pageCompression': 1, 'useA85': 0},
+}
+
 
 class Document:
-    def __init__(self, file):
+    def __init__(self, file, stream=False, output=None, prefix='', pdf_profile='default'):
+        if pdf_profile not in PROFILES:
+            raise ValueError('Unknown PDF profile `{}`, expected one of: {}'.format(
+                pdf_profile, ', '.join(PROFILES)
+            ))
         self.file = file
+        self.stream = stream
+        # path or binary file object, `<name>.pdf` by default
+        self.output = output
+        self.pdf_profile = PROFILES[pdf_profile]
+        # body text preceding this one, keeps line numbers right for chunks
+        self.prefix = prefix
 
         self.font = 'Tahoma'
         self.font_size = 12
@@ -27,21 +55,31 @@ class Document:
         self.runtime = None
         self.intro = None
         self.intro_code = None
+        # names the intro assigns or takes as arguments, see `resolve`
+        self.intro_names = frozenset()
+        self.prefix_code = None
+        self.snapshot = None
+        self.body = None
+        self.body_code = None
+        self.txt = None
+        self.pages = None
+        self.page_count = 0
+        self.first_line = True
 
         self.init_canvas(file)
 
     def init_canvas(self, fname):
-        fname = os.path.splitext(fname)[0]
+        output = self.output
+        if output is None:
+            output = '{}.pdf'.format(os.path.splitext(fname)[0])
         self.canvas = Canvas(
-            '{}.pdf'.format(fname),
-            pagesize=self.page_size
-        )
-        pdfmetrics.registerFont(TTFont(self.font, '{}.ttf'.format(self.font)))
-        self.canvas.setFont(
-            self.font,
-            self.font_size,
-            self.font_size * self.leading
+            output,
+            pagesize=self.page_size,
+            pageCompression=self.pdf_profile.get('pageCompression')
         )
+        if self.font not in pdfmetrics._fonts:
+            pdfmetrics.registerFont(fonts.load(self.font, '{}.ttf'.format(self.font)))
+        self.canvas.setFont(*self.page_font())
         self.canvas.setCreator("press")
         self.canvas.setProducer("")
         self.canvas.setAuthor("")
@@ -49,56 +87,188 @@ class Document:
         self.canvas.setSubject("")
 
     def init(self, intro):
+        # `intro` and `snapshot` are only set once the intro ran through,
+        # a broken one is run again by the next `watch` build
+        intro = intro.strip()
+        self.snapshot = None
         self.runtime = Runtime()
-        self.intro = intro.strip()
-        self.intro_code = press_lang.parse(
-            self.intro,
-            actions=press_lang_ast.Actions
-        )
-        self.intro_code.file = os.path.abspath(self.file)
-        self.intro_code.text = self.intro
-        self.intro_code.set_parent(None)
-        self.intro_code.execute(self.runtime)
+        if tracing.parse:
+            tracing.event('parse', 'intro', file=self.file, chars=len(intro))
+        with profiler.phase('intro parse'):
+            self.intro_code = cached_parse(
+                press_lang,
+                intro,
+                press_lang_ast.Actions
+            )
+            self.intro_code.file = os.path.abspath(self.file)
+            self.intro_code.text = intro
+            self.intro_code.set_parent(None)
+            self.intro_names = frozenset(press_lang_ast.resolve(self.intro_code, self.runtime))
+        with profiler.phase('intro execute'):
+            self.intro_code.execute(self.runtime)
+        self.intro = intro
+        self.snapshot = self.runtime.snapshot()
+
+    def reset(self):
+        self.runtime.restore(self.snapshot)
 
     def parse(self, text):
-        root = template.parse(text.strip(), actions=template_ast.Actions)
-        root.prefix = self.intro + '\n--------\n'
-        root.file = os.path.abspath(self.file)
-        root.text = text.strip()
-        root.set_parent(None)
+        with profiler.phase('body parse'):
+            return self._parse(text)
+
+    def _parse(self, text):
+        text = text.strip()
+        reuse = self.body_code is not None and self.body == text
+        if tracing.parse:
+            tracing.event('parse', 'body', file=self.file, chars=len(text), reused=reuse)
+        if reuse:
+            root = self.body_code
+            for node in root.walk():
+                if isinstance(node, template_ast.Template):
+                    node.lazy = True
+        else:
+            root = cached_parse(scan, text, template_ast.Actions)
+            root.file = os.path.abspath(self.file)
+            root.text = text
+            root.set_parent(None)
+            self.body = text
+            self.body_code = root
+        root.prefix = self.intro + '\n--------\n' + self.prefix
+        # intro functions run bracket arguments of the body and the body
+        # may call intro functions, so either can rebind the other's names
+        names = press_lang_ast.resolve(root, self.runtime, self.intro_names)
+        press_lang_ast.resolve(self.intro_code, self.runtime, names)
+        if self.prefix_code is not None:
+            press_lang_ast.resolve(self.prefix_code, self.runtime, names)
         return root
 
+    def run_prefix(self):
+        # Executes the body text before this chunk without laying it out,
+        # so the chunk starts with the definitions and settings it has in
+        # a serial run. Its names count as the intro's from here on.
+        text = self.prefix.strip()
+        if not text:
+            return
+        with profiler.phase('body parse'):
+            root = cached_parse(scan, text, template_ast.Actions)
+            root.file = os.path.abspath(self.file)
+            root.text = text
+            root.set_parent(None)
+            root.prefix = self.intro + '\n--------\n'
+            self.intro_names = frozenset(
+                press_lang_ast.resolve(root, self.runtime, self.intro_names)
+            )
+            self.prefix_code = root
+        with profiler.phase('body execute'):
+            self.runtime.sink = lambda item: None
+            try:
+                root.execute(self.runtime)
+            finally:
+                self.runtime.sink = None
+
     def render(self, text):
-        items = self.parse(text).execute(self.runtime)
-        print(items)
-
-        txt = self.canvas.beginText()
-        first_line = True
-        for item in items:
-            item.apply(txt, runtime=self.runtime)
-
-            lines = item.lines()
-            for idx, line in enumerate(lines):
-                if first_line:
-                    item.set_text_origin(txt)
-                first_line = False
-                # print(repr((line, idx)))
-                item.text_line(txt, line, final=idx == len(lines) - 1)
-
-                if txt.getY() < self.margins[1]:
-                    self.canvas.drawText(txt)
-                    self.canvas.showPage()
-                    self.canvas.setFont(
-                        self.font,
-                        self.font_size,
-                        self.font_size * self.leading
-                    )
-                    txt = self.canvas.beginText()
-                    item.apply(txt, text_only=True, runtime=self.runtime)
-                    first_line = True
-
-        if txt:
-            self.canvas.drawText(txt)
+        if self.stream:
+            # finished pages go to the canvas right away, see `new_page`
+            self.layout(text, draw=True)
+        else:
+            self.draw(self.layout(text))
+
+    def layout(self, text, draw=False):
+        # Display list: the text operations of every page, see `display`.
+        # With `draw` each page is drawn once finished instead of kept.
+        self.pages = None if draw else []
+        self.page_count = 0
+        self.txt = self.begin_page()
+        self.first_line = True
+        place = self.place
+        if profiler.current is not None:
+            place = profiler.current.timed('layout', place)
+        coalescer = Coalescer(place)
+        root = self.parse(text)
+        if self.stream:
+            self.runtime.sink = coalescer.add
+            try:
+                with profiler.phase('body execute'):
+                    root.execute(self.runtime)
+            finally:
+                self.runtime.sink = None
+            if tracing.execute:
+                tracing.event('execute', 'body', streamed=True)
+        else:
+            with profiler.phase('body execute'):
+                items = root.execute(self.runtime)
+            if tracing.execute:
+                tracing.event('execute', 'body', items=len(items))
+            for item in items:
+                coalescer.add(item)
+        with profiler.phase('layout'):
+            coalescer.flush()
+            self.finish_page()
+        return self.pages
+
+    def draw(self, pages):
+        with profiler.phase('draw'):
+            pdf.draw(self.canvas, pages, self.page_font())
+
+    def place(self, item):
+        if isinstance(item, PageBreak):
+            if tracing.page:
+                tracing.event('page', 'break', page=self.page_count + 1, empty=self.first_line)
+            if not self.first_line:
+                self.new_page()
+            return
+
+        txt = self.txt
+        item.apply(txt, runtime=self.runtime)
+
+        lines = item.lines()
+        if tracing.layout:
+            state = item.state
+            tracing.event(
+                'layout', type(item).__name__, text=item.text, font=state.font,
+                size=state.font_size, column=state.column, y=txt.getY(), lines=len(lines)
+            )
+        for idx, line in enumerate(lines):
+            if self.first_line:
+                item.set_text_origin(txt)
+            self.first_line = False
+            item.text_line(txt, line, final=idx == len(lines) - 1)
+
+            if txt.getY() < self.margins[1]:
+                self.new_page()
+                txt = self.txt
+                item.apply(txt, text_only=True, runtime=self.runtime)
+
+    def new_page(self):
+        if tracing.page:
+            tracing.event('page', 'new', page=self.page_count + 2, y=self.txt.getY())
+        self.finish_page()
+        if self.pages is None:
+            self.canvas.showPage()
+            self.canvas.setFont(*self.page_font())
+        self.txt = self.begin_page()
+        self.first_line = True
+
+    def finish_page(self):
+        self.page_count += 1
+        if self.pages is None:
+            with profiler.phase('draw'):
+                pdf.draw_page(self.canvas, self.txt.ops)
+        else:
+            self.pages.append(self.txt.ops)
+
+    def page_font(self):
+        return self.font, self.font_size, self.font_size * self.leading
+
+    def begin_page(self):
+        return TextRecorder(*self.page_font())
 
     def save(self):
-        self.canvas.save()
+        with profiler.phase('save'):
+            use_a85 = rl_config.useA85
+            rl_config.useA85 = self.pdf_profile.get('useA85', use_a85)
+            try:
+                self.canvas.save()
+            finally:
+                rl_config.useA85 = use_a85
+            paragraphs.save()
@@ -0,0 +1,113 @@
+import os
+from weakref import WeakKeyDictionary
+
+import reportlab
+from reportlab.lib.fonts import addMapping
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont, TTFOpenFile
+
+from cache import DiskCache
+
+_cache = DiskCache('fonts', fingerprint=reportlab.Version, max_size=256 * 1024 * 1024)
+
+# Collection subfonts that are mapped but not loaded yet: name -> (file, index)
+_lazy = {}
+
+
+def _scale(units_per_em):
+    if units_per_em == 1000:
+        return lambda x: x
+    multiplier = 1000 / units_per_em
+    return lambda x: x * multiplier
+
+
+def _dump(font):
+    # The font file itself is read again on load, only parsed tables are kept
+    face = {
+        key: value for key, value in vars(font.face).items()
+        if key not in ('_pdfScale', '_ttf_data')
+    }
+    attrs = {key: value for key, value in vars(font).items() if key not in ('face', 'state')}
+    return type(font.face), face, attrs
+
+
+def _restore(dump):
+    face_class, face_attrs, attrs = dump
+    face = face_class.__new__(face_class)
+    face.__dict__.update(face_attrs)
+    face._pdfScale = _scale(face.unitsPerEm)
+    with open(face.filename, 'rb') as f:
+        face._ttf_data = f.read()
+    font = TTFont.__new__(TTFont)
+    font.__dict__.update(attrs)
+    font.face = face
+    font.state = WeakKeyDictionary()
+    return font
+
+
+def locate(file):
+    path, f = TTFOpenFile(file)
+    f.close()
+    return os.path.abspath(path)
+
+
+def load(name, file, subfont_index=0):
+    path = locate(file)
+    key = _cache.key(path, str(os.stat(path).st_mtime_ns), str(subfont_index))
+    dump = _cache.get(key)
+    if dump is not None:
+        try:
+            font = _restore(dump)
+        except (AttributeError, KeyError, OSError, TypeError, ValueError):
+            font = None
+        if font is not None:
+            font.fontName = name
+            return font
+    font = TTFont(name, path, subfontIndex=subfont_index)
+    _cache.set(key, _dump(font))
+    return font
+
+
+def describe(face):
+    family_name = face.familyName.decode('utf-8')
+    full_name = face.name.decode('utf-8')
+    if isinstance(face.styleName, bytes):
+        style_name = face.styleName.decode('utf-8')
+    else:
+        style_name = face.styleName
+    style_name = style_name.lower()
+    bold = int('bold' in style_name)
+    italic = int('italic' in style_name)
+    return full_name, family_name, bold, italic
+
+
+def subfonts(font):
+    path = font.face.filename
+    key = _cache.key('subfonts', path, str(os.stat(path).st_mtime_ns))
+    result = _cache.get(key)
+    if result is None:
+        result = []
+        for idx, _ in enumerate(font.face.subfontOffsets[1:]):
+            subfont = load(None, path, idx + 1)
+            result.append((idx + 1,) + describe(subfont.face))
+        _cache.set(key, result)
+    return result
+
+
+def register(name, file):
+    font = load(name, file)
+    pdfmetrics.registerFont(font)
+    full_name, family_name, bold, italic = describe(font.face)
+    addMapping(family_name, bold, italic, full_name)
+    if font.face.fileKind == 'TTC':
+        for idx, full_name, family_name, bold, italic in subfonts(font):
+            addMapping(family_name, bold, italic, full_name)
+            if full_name not in pdfmetrics._fonts:
+                _lazy[full_name] = (font.face.filename, idx)
+    return font
+
+
+def ensure(name):
+    entry = _lazy.pop(name, None)
+    if entry is not None:
+        pdfmetrics.registerFont(load(name, *entry))
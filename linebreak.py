@@ -0,0 +1,124 @@
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAX_LOOKAHEAD = 64
+
+
+def greedy(widths, space, width):
+    if np is not None and isinstance(widths, np.ndarray):
+        return _greedy_array(widths, space, width)
+    result = []
+    start = 0
+    used_width = 0
+    for idx, wwidth in enumerate(widths):
+        if not used_width or used_width + wwidth < width:
+            used_width += wwidth + space
+        else:
+            result.append((start, idx))
+            start = idx
+            used_width = wwidth
+    if start < len(widths):
+        result.append((start, len(widths)))
+    return result
+
+
+def _greedy_array(widths, space, width):
+    # Same decisions as the list version: the first word of a line is
+    # always taken, and a line started by a break does not count the space
+    # after its first word. The cumulative sums round differently from the
+    # running total of the list version, so a line end too close to call
+    # is found again with its arithmetic.
+    n = len(widths)
+    ends = np.cumsum(widths + space)
+    reach = (ends - space).tolist()
+    before = (ends - (widths + space)).tolist()
+    # bound on the rounding error of either sum
+    margin = 1e-15 * n * (abs(reach[-1]) + abs(width)) if n else 0
+    widths = widths.tolist()
+    result = []
+    start = 0
+    while start < n:
+        # width used after the first word of the line
+        if result:
+            used, bound = widths[start], width + before[start] + space
+        else:
+            used, bound = widths[start] + space, width + before[start]
+        end = start + 1
+        if not used:
+            # words are taken regardless while nothing is used yet
+            end = _line_end(widths, space, width, end, used)
+        elif end < n:
+            end = bisect_left(reach, bound, end)
+            if end > start + 1 and bound - reach[end - 1] <= margin \
+                    or end < n and reach[end] - bound <= margin:
+                end = _line_end(widths, space, width, start + 1, used)
+        result.append((start, end))
+        start = end
+    return result
+
+
+def _line_end(widths, space, width, end, used):
+    # The list version for the rest of a line
+    while end < len(widths) and (not used or used + widths[end] < width):
+        used += widths[end] + space
+        end += 1
+    return end
+
+
+def total_fit(widths, space, width, lookahead=MAX_LOOKAHEAD, tolerance=0.5):
+    # Minimizes the sum of squared relative slack over all lines but the
+    # last. Only line ends within `tolerance` of the full width and at most
+    # `lookahead` words away from the line start are considered, so every
+    # start has a handful of candidates and the whole pass stays linear.
+    if np is not None and isinstance(widths, np.ndarray):
+        ends = [0.0] + np.cumsum(widths + space).tolist()
+    else:
+        ends = [0.0] + list(accumulate(w + space for w in widths))
+    n = len(ends) - 1
+    if not n:
+        return []
+    inf = float('inf')
+    best = [0.0] + [inf] * n
+    prev = [0] * (n + 1)
+    for start in range(n):
+        cost = best[start]
+        if cost == inf:
+            continue
+        offset = ends[start] + space
+        limit = min(n, start + lookahead)
+        first = bisect_left(ends, offset + width * (1 - tolerance), start + 1, limit + 1)
+        last = bisect_right(ends, offset + width, start + 1, limit + 1) - 1
+        candidates = range(max(first, start + 1), last + 1)
+        if not candidates:
+            candidates = (max(last, start + 1),)
+        if last == n and n not in candidates:
+            candidates = list(candidates) + [n]
+        for end in candidates:
+            natural = ends[end] - offset
+            if end == n and natural <= width:
+                badness = 0.0
+            elif natural > width:
+                badness = 1e6
+            else:
+                badness = 100 * ((width - natural) / width) ** 2
+            if cost + badness < best[end]:
+                best[end] = cost + badness
+                prev[end] = start
+    result = []
+    end = n
+    while end > 0:
+        result.append((prev[end], end))
+        end = prev[end]
+    result.reverse()
+    return result
+
+
+ENGINES = {
+    'greedy': greedy,
+    'total_fit': total_fit,
+}
@@ -0,0 +1,40 @@
+from functools import lru_cache
+
+from reportlab.pdfbase import pdfmetrics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Paragraphs shorter than this are cheaper to break word by word
+MIN_WORDS = 32
+MAX_CODEPOINT = 0x10000
+
+
+@lru_cache(maxsize=None)
+def glyph_widths(font):
+    face = getattr(pdfmetrics.getFont(font), 'face', None)
+    if np is None or not hasattr(face, 'charWidths'):
+        return None
+    size = min(max(face.charWidths, default=0) + 1, MAX_CODEPOINT)
+    widths = np.full(size, face.defaultWidth, dtype=np.float64)
+    for code, width in face.charWidths.items():
+        if code < size:
+            widths[code] = width
+    return widths
+
+
+def word_widths(font, size, words):
+    widths = glyph_widths(font)
+    if widths is None:
+        return None
+    codes = np.frombuffer(' '.join(words).encode('utf-32-le'), dtype=np.uint32)
+    if codes.size and codes.max() >= widths.size:
+        return None
+    sums = np.zeros(codes.size + 1)
+    np.cumsum(widths[codes], out=sums[1:])
+    lengths = np.fromiter(map(len, words), dtype=np.intp, count=len(words))
+    ends = np.cumsum(lengths + 1) - 1
+    return (sums[ends] - sums[ends - lengths]) * (0.001 * size)
+
@@ -0,0 +1,83 @@
+import hashlib
+import os
+from collections import OrderedDict
+from functools import lru_cache
+
+import reportlab
+from reportlab.pdfbase import pdfmetrics
+
+from cache import DiskCache, file_digest
+
+MAX_ENTRIES = 2000
+# computed paragraphs held before they are written out
+MAX_PENDING = 256
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_cache = DiskCache(
+    'paragraphs',
+    fingerprint=reportlab.Version + file_digest(
+        *(os.path.join(_here, name) for name in ('linebreak.py', 'measure.py', 'text_fragment.py'))
+    ),
+    max_size=256 * 1024 * 1024,
+)
+
+# (text digest, font, size, width, engine) -> lines, least recently used
+# first. Every paragraph is its own disk entry, so runs sharing the cache
+# only ever add to it and eviction works per paragraph.
+_lines = OrderedDict()
+# entries computed since they were last written out
+_pending = {}
+# whether entries were written since the last eviction
+_written = False
+
+
+@lru_cache(maxsize=None)
+def font_key(font):
+    # Embedded fonts are identified by their file too, so editing one
+    # invalidates its paragraphs
+    path = getattr(getattr(pdfmetrics.getFont(font), 'face', None), 'filename', None)
+    if path is None:
+        return font
+    try:
+        return font, path, os.stat(path).st_mtime_ns
+    except OSError:
+        return font, path
+
+
+def lines(text, font, size, width, engine, compute):
+    key = (
+        hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest(),
+        font_key(font), size, width, engine,
+    )
+    result = _lines.get(key)
+    if result is not None:
+        _lines.move_to_end(key)
+        return result
+    result = _cache.get(_cache.key(repr(key)))
+    if result is None:
+        result = compute()
+        if _cache.enabled:
+            _pending[key] = result
+            if len(_pending) >= MAX_PENDING:
+                _write()
+    _lines[key] = result
+    if len(_lines) > MAX_ENTRIES:
+        _lines.popitem(last=False)
+    return result
+
+
+def _write():
+    # eviction scans the whole directory, it only runs on `save`
+    global _written
+    for key, result in _pending.items():
+        _cache.set(_cache.key(repr(key)), result, evict=False)
+    _written = _written or bool(_pending)
+    _pending.clear()
+
+
+def save():
+    global _written
+    _write()
+    if _written:
+        _cache.evict()
+        _written = False
@@ -1,14 +1,43 @@
+import inspect
+from ast import literal_eval
+from bisect import bisect_right
+
+import profiler
+import tracing
 from runtime import Runtime, NameResolutionError, PressError
 
 
+class FrozenDict(dict):
+    # Value of a constant object literal, shared by every execution
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('Object literals are immutable')
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+    __ior__ = _immutable
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def literal(value):
+    # Decoded value of a constant argument, None, true and false included
+    if isinstance(value, Node):
+        return value.literal
+    return value
+
+
+def is_constant(value):
+    return not isinstance(value, Node) or value.constant
+
+
 def prepare_arg(caller, runtime, arg):
-    if isinstance(arg, Number):
-        if '.' in arg.value:
-            return float(arg.value)
-        else:
-            return int(arg.value)
-    elif isinstance(arg, String):
-        return eval(arg.value)
+    if is_constant(arg):
+        return literal(arg)
     elif isinstance(arg, List):
         return list(map(lambda el: prepare_arg(caller, runtime, el), arg.elements))
     elif isinstance(arg, Object):
@@ -30,8 +59,50 @@ def prepare_arg(caller, runtime, arg):
         return arg
 
 
+def compile_arg(arg):
+    # Returns (constant, value): constants are decoded at parse time,
+    # everything else becomes a function of (runtime, caller) with
+    # prepare_arg semantics
+    if is_constant(arg):
+        return True, literal(arg)
+    elif isinstance(arg, (List, Object)):
+        if isinstance(arg, List):
+            parts = [compile_arg(el) for el in arg.elements]
+        else:
+            parts = []
+            for pair in arg.elements:
+                parts.append(compile_arg(pair.key))
+                parts.append(compile_arg(pair.value))
+
+        def prepare(runtime, caller):
+            return [value if fixed else value(runtime, caller) for fixed, value in parts]
+        if isinstance(arg, List):
+            return False, prepare
+
+        def prepare_object(runtime, caller):
+            values = prepare(runtime, caller)
+            return dict(zip(values[::2], values[1::2]))
+        return False, prepare_object
+    elif hasattr(arg, 'execute'):
+        execute = arg.execute
+        if hasattr(arg, 'lazy'):
+            def prepare_lazy(runtime, caller):
+                if arg.lazy:
+                    arg.lazy = False
+                    return arg
+                return execute(runtime, caller=caller)
+            return False, prepare_lazy
+        return False, lambda runtime, caller: execute(runtime, caller=caller)
+    else:
+        return True, arg
+
+
 class Node:
-    child_attr = 'elements'
+    # attributes holding child nodes, alone or in lists
+    links = ('elements',)
+    # Literals and literal containers decode to `literal` at parse time
+    constant = False
+    literal = None
 
     def __init__(self, *args, start=None, end=None) -> None:
         super().__init__()
@@ -41,44 +112,107 @@ class Node:
         self.parent = None
         self.root = None
         self.prefix = None
+        self._code = None
+        self._lines = None
+        self._prefix_lines = None
 
     def set_parent(self, parent):
-        if parent is not None:
-            root = parent.root
-        else:
-            root = self
-        if self.parent is None:
-            self.parent = parent
-            self.root = root
-
-        if self.has_children():
-            for child in self.children():
-                if isinstance(child, Node):
-                    child.set_parent(self)
-
-    def has_children(self):
-        return hasattr(self, self.__class__.child_attr)
-
-    def children(self):
-        return getattr(self, self.__class__.child_attr)
+        pending = [(self, parent)]
+        while pending:
+            node, parent = pending.pop()
+            if node.parent is None:
+                node.parent = parent
+                node.root = node if parent is None else parent.root
+            for name in node.links:
+                value = getattr(node, name)
+                if type(value) is list:
+                    for child in value:
+                        if isinstance(child, Node):
+                            pending.append((child, node))
+                elif isinstance(value, Node):
+                    pending.append((value, node))
+
+    def walk(self):
+        pending = [self]
+        while pending:
+            node = pending.pop()
+            yield node
+            for name in node.links:
+                value = getattr(node, name)
+                if type(value) is list:
+                    for child in value:
+                        if isinstance(child, Node):
+                            pending.append(child)
+                elif isinstance(value, Node):
+                    pending.append(value)
 
     @property
     def prefix_lines(self):
         if self.prefix is None:
             return 0
-        return self.prefix.count('\n')
+        if self._prefix_lines is None or self._prefix_lines[0] is not self.prefix:
+            self._prefix_lines = (self.prefix, self.prefix.count('\n'))
+        return self._prefix_lines[1]
+
+    def line_starts(self):
+        # Start offset of every line of the root text, rebuilt when the
+        # text is replaced
+        root = self.root or self
+        if root._lines is None or root._lines[0] is not root.text:
+            text = root.text
+            starts = [0]
+            pos = text.find('\n')
+            while pos != -1:
+                starts.append(pos + 1)
+                pos = text.find('\n', pos + 1)
+            root._lines = (text, starts)
+        return root._lines[1]
+
+    def line_index(self, offset):
+        return bisect_right(self.line_starts(), offset) - 1
+
+    def source_location(self, offset=None):
+        # (file, line, column) of an offset into the root text, the node
+        # start by default; lines count from 1 and include the prefix
+        if offset is None:
+            offset = self.start
+        root = self.root
+        index = self.line_index(offset)
+        column = offset - self.line_starts()[index]
+        return root.file, index + 1 + root.prefix_lines, column + 1
+
+    def source_line(self):
+        # The source line holding the node start, cut off at the node end
+        text = self.root.text
+        starts = self.line_starts()
+        index = self.line_index(self.start)
+        end = min(self.end + 1, len(text))
+        if index + 1 < len(starts) and starts[index + 1] - 1 < end:
+            return text[starts[index]:starts[index + 1] - 1]
+        return text[starts[index]:end - 1]
 
 
 class String(Node):
+    links = ()
+    constant = True
+
     def __init__(self, value, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.value = value
+        self.literal = literal_eval(value)
 
 
 class Number(Node):
+    links = ()
+    constant = True
+
     def __init__(self, value, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.value = value
+        if '.' in value or 'e' in value or 'E' in value:
+            self.literal = float(value)
+        else:
+            self.literal = int(value)
 
     def __str__(self):
         return self.value
@@ -88,83 +222,128 @@ class Number(Node):
 
 
 class Call(Node):
+    links = ('args', 'subject')
+
     def __init__(self, subject, args, *pargs, **kwargs):
         super().__init__(*pargs, **kwargs)
         self.subject = subject
         self.args = args
+        # set by `resolve` when the name can only refer to a builtin
+        self.builtin = False
 
     def execute(self, runtime: Runtime, caller: Node = None):
-        self.caller = caller
-
-        if runtime.has(self.subject):
-            subject = runtime.get(self.subject)
-            args = self.prepare_args(runtime)
+        if self._code is None:
+            self._code = self.compile()
+            if profiler.current is not None:
+                self._code = profiler.current.call(self, self._code)
+            if tracing.execute:
+                self._code = tracing.call(self, self._code)
+        return self._code(runtime, caller)
+
+    def compile(self):
+        name = self.subject
+        args = [compile_arg(arg) for arg in self.args]
+        constant = all(constant for constant, _ in args)
+        values = [value for _, value in args]
+
+        if self.builtin:
+            # Resolved builtins are called directly, without the wrapper
+            # that strips `caller` for functions not taking it
+            func = Runtime.registry[name]
+            takes_caller = 'caller' in inspect.signature(func).parameters
+
+            def call(runtime, caller):
+                self.caller = caller
+                if constant:
+                    prepared = values
+                else:
+                    prepared = [value if fixed else value(runtime, self) for fixed, value in args]
+                try:
+                    if takes_caller:
+                        return func(runtime, *prepared, caller=self)
+                    return func(runtime, *prepared)
+                except Exception as e:
+                    raise PressError(e, node=self)
+            return call
+
+        def call(runtime, caller):
+            self.caller = caller
+            try:
+                subject = runtime.get(name)
+            except KeyError:
+                raise NameResolutionError(name, node=self)
+            if constant:
+                prepared = values
+            else:
+                prepared = [value if fixed else value(runtime, self) for fixed, value in args]
             if callable(subject):
                 try:
-                    return subject(runtime, *args, caller=self)
+                    return subject(runtime, *prepared, caller=self)
                 except Exception as e:
                     raise PressError(e, node=self)
             elif hasattr(subject, 'execute'):
-                return subject.execute(runtime, *args, caller=self)
+                return subject.execute(runtime, *prepared, caller=self)
             else:
                 return subject
-        else:
-            raise NameResolutionError(self.subject, node=self)
-
-    def prepare_args(self, runtime):
-        result = []
-        for arg in self.args:
-            result.append(prepare_arg(self, runtime, arg))
-        return result
-
-    def has_children(self):
-        return True
-
-    def children(self):
-        return self.args + [self.subject]
+        return call
 
 
 class Assignment(Node):
+    links = ('subject', 'expr')
+
     def __init__(self, subject, expr, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.subject = subject
         self.expr = expr
 
     def execute(self, runtime, caller: Node = None):
-        self.caller = caller
+        if self._code is None:
+            self._code = self.compile()
+        return self._code(runtime, caller)
 
+    def compile(self):
+        name = self.subject
         expr = self.expr
-        if hasattr(expr, 'execute') and not isinstance(self.expr, Function):
-            expr = expr.execute(runtime, caller=self)
-        runtime.set(self.subject, expr)
+        if hasattr(expr, 'execute') and not isinstance(expr, Function):
+            execute = expr.execute
 
-    def has_children(self):
-        return True
-
-    def children(self):
-        return [self.subject, self.expr]
+            def assign(runtime, caller):
+                self.caller = caller
+                runtime.stack[-1][name] = execute(runtime, caller=self)
+        else:
+            def assign(runtime, caller):
+                self.caller = caller
+                runtime.stack[-1][name] = expr
+        return assign
 
 
 class Function(Node):
+    links = ('args', 'code')
+
     def __init__(self, args, code, *pargs, **kwargs):
         super().__init__(*pargs, **kwargs)
         self.args = args
         self.code = code
 
     def execute(self, runtime, *args, caller: Node = None):
-        self.caller = caller
-
-        runtime.push()
-        for i, arg in enumerate(args):
-            runtime.set(self.args[i], arg)
-        self.code.execute(runtime, caller=self)
-        runtime.pop()
-
-    def has_children(self):
-        return True
-
-    def children(self):
-        return self.args + [self.code]
+        if self._code is None:
+            self._code = self.compile()
+        self._code(runtime, args, caller)
+
+    def compile(self):
+        # Unlike the other nodes this takes the call arguments too
+        names = self.args
+        execute = self.code.execute
+
+        def run(runtime, args, caller):
+            self.caller = caller
+            frame = {}
+            for i, arg in enumerate(args):
+                frame[names[i]] = arg
+            runtime.stack.append(frame)
+            execute(runtime, caller=self)
+            runtime.stack.pop()
+        return run
 
 
 class Statements(Node):
@@ -173,36 +352,91 @@ class Statements(Node):
         self.elements = exprs
 
     def execute(self, runtime, caller: Node = None):
-        self.caller = caller
+        if self._code is None:
+            self._code = self.compile()
+        return self._code(runtime, caller)
 
-        for expr in self.elements:
-            if hasattr(expr, 'execute'):
-                expr.execute(runtime, caller=self)
+    def compile(self):
+        executes = [expr.execute for expr in self.elements if hasattr(expr, 'execute')]
+
+        def run(runtime, caller):
+            self.caller = caller
+            for execute in executes:
+                execute(runtime, caller=self)
+        return run
 
 
 class List(Node):
     def __init__(self, elements, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.elements = elements
+        if all(map(is_constant, elements)):
+            self.constant = True
+            self.literal = tuple(map(literal, elements))
 
 
 class Object(Node):
     def __init__(self, elements, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.elements = elements
+        if all(is_constant(pair.key) and is_constant(pair.value) for pair in elements):
+            self.constant = True
+            self.literal = FrozenDict(
+                (literal(pair.key), literal(pair.value)) for pair in elements
+            )
 
 
 class Pair(Node):
+    links = ('key', 'value')
+
     def __init__(self, key, value, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.key = key
         self.value = value
 
-    def has_children(self):
-        return True
 
-    def children(self):
-        return [self.key, self.value]
+def resolve(root, runtime, assigned=()):
+    # Scoping is dynamic, so only names nothing can rebind are bound ahead
+    # of time: builtins never assigned to or used as function arguments,
+    # here or in the other trees that share the runtime (`assigned`).
+    # Unknown names outside of functions are reported before execution;
+    # bracket arguments run inside whatever function they are passed to,
+    # so they count as function bodies too. Returns every rebindable name.
+    assigned = set(assigned)
+    calls = []
+    pending = [(root, False)]
+    while pending:
+        node, in_function = pending.pop()
+        if isinstance(node, Assignment):
+            assigned.add(node.subject)
+        elif isinstance(node, Function):
+            assigned.update(node.args)
+            in_function = True
+        elif hasattr(node, 'lazy') and node is not root:
+            in_function = True
+        elif isinstance(node, Call):
+            calls.append((node, in_function))
+        for name in node.links:
+            value = getattr(node, name)
+            if type(value) is list:
+                for child in value:
+                    if isinstance(child, Node):
+                        pending.append((child, in_function))
+            elif isinstance(value, Node):
+                pending.append((value, in_function))
+
+    for call, in_function in calls:
+        name = call.subject
+        builtin = runtime.builtins.get(name)
+        builtin = builtin is not None and name not in assigned \
+            and runtime.get(name) is builtin
+        if call.builtin != builtin:
+            call.builtin = builtin
+            call._code = None
+        if not call.builtin and not in_function and name not in assigned \
+                and not runtime.has(name):
+            raise NameResolutionError(name, node=call)
+    return assigned
 
 
 class Actions:
@@ -9,17 +9,31 @@ class Template(Node):
         self.lazy = True
 
     def execute(self, runtime, caller: Node = None):
-        self.caller = caller
+        if self._code is None:
+            self._code = self.compile()
+        return self._code(runtime, caller)
 
-        runtime.push_buffer()
-        if not self.elements[0]:
+    def compile(self):
+        if self.elements and not self.elements[0]:
             self.elements = self.elements[1:]
+        parts = []
         for element in self.elements:
-            if type(element) == str and element:
-                runtime.add_text(element)
+            if type(element) == str:
+                if element:
+                    parts.append((True, element))
             else:
-                element.execute(runtime, caller=self)
-        return runtime.pop_buffer()
+                parts.append((False, element.execute))
+
+        def run(runtime, caller):
+            self.caller = caller
+            runtime.push_buffer()
+            for text, part in parts:
+                if text:
+                    runtime.add_text(part)
+                else:
+                    part(runtime, caller=self)
+            return runtime.pop_buffer()
+        return run
 
 
 class Actions(Base):
@@ -0,0 +1,36 @@
+import os
+import sys
+
+from cache import DiskCache, file_digest
+
+_caches = {}
+
+
+def _fingerprint(parser, actions):
+    # front ends such as `scan` name the generated parser they build on
+    grammar = getattr(parser, 'grammar', parser)
+    name = grammar.__name__.rsplit('.', 1)[-1]
+    files = [
+        parser.__file__,
+        os.path.join(os.path.dirname(__file__), '{}.peg'.format(name)),
+    ]
+    if grammar is not parser:
+        files.append(grammar.__file__)
+    for cls in actions.__mro__:
+        module = sys.modules.get(cls.__module__)
+        if getattr(module, '__file__', None) and module.__file__ not in files:
+            files.append(module.__file__)
+    return file_digest(*files)
+
+
+def parse(parser, text, actions):
+    if (parser, actions) not in _caches:
+        name = 'ast-{}'.format(parser.__name__.rsplit('.', 1)[-1])
+        _caches[parser, actions] = DiskCache(name, _fingerprint(parser, actions))
+    cache = _caches[parser, actions]
+    key = cache.key(actions.__qualname__, text)
+    root = cache.get(key)
+    if root is None:
+        root = parser.parse(text, actions=actions)
+        cache.set(key, root)
+    return root
@@ -0,0 +1,34 @@
+from . import template
+from .ast.template import Template
+
+# The generated parser this front end reads insertions with, the cache
+# fingerprints it along with this module
+grammar = template
+
+
+def parse(input, actions=None, types=None):
+    # Top level text cannot contain `[`, so it is found with str.find and
+    # only the insertions go through the generated parser. Anything the
+    # insertion rule rejects is parsed again in full for the error message.
+    parser = template.Parser(input, actions, types)
+    parts = []
+    offset = 0
+    while True:
+        pos = input.find('[', offset)
+        if pos == -1:
+            text = input[offset:]
+            if text or not parts:
+                parts.append(text)
+            break
+        text = input[offset:pos]
+        if text or not parts:
+            parts.append(text)
+        parser._offset = pos
+        node = parser._read_insertion()
+        if node is template.FAILURE:
+            return template.parse(input, actions=actions, types=types)
+        parts.append(node.statements)
+        offset = parser._offset
+        # memoized results never apply before the current offset
+        parser._cache.clear()
+    return Template(parts, start=0, end=len(input))
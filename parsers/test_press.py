@@ -1,3 +1,8 @@
+import pickle
+
+import pytest
+
+from runtime import NameResolutionError, Runtime
 from . import press_lang
 from . import utils
 from .ast import press_lang as ast
@@ -15,6 +20,7 @@ def test_numbers():
 def test_strings():
     e = parse('"123"')
     assert e.elements[0].value == '"123"'
+    assert e.elements[0].literal == '123'
 
 
 def test_functions():
@@ -99,3 +105,42 @@ def test_objects():
     assert e.elements[0].elements[0].value.value == '1'
     assert e.elements[0].elements[1].key.subject == 'b'
     assert e.elements[0].elements[1].value.value == '2'
+
+
+def test_resolve():
+    runtime = Runtime()
+    e = parse('a = 1; size(a); f = function(x) { x; later }')
+    e.set_parent(None)
+    ast.resolve(e, runtime)
+    assert e.elements[1].builtin
+    assert not e.elements[1].args[0].builtin
+    e = parse('size = 1; size')
+    e.set_parent(None)
+    ast.resolve(e, runtime)
+    assert not e.elements[1].builtin
+    e = parse('missing(1)')
+    e.set_parent(None)
+    with pytest.raises(NameResolutionError):
+        ast.resolve(e, runtime)
+
+
+def test_literals():
+    e = parse('f((1, 2.5, "a\\n"), {"x"=(true, null)}, (1, a))')
+    args = e.elements[0].args
+    assert args[0].literal == (1, 2.5, 'a\n')
+    assert args[1].literal == {'x': (True, None)}
+    with pytest.raises(TypeError):
+        args[1].literal['y'] = 1
+    assert pickle.loads(pickle.dumps(args[1].literal)) == args[1].literal
+    assert not args[2].constant
+
+
+def test_deep_nesting():
+    node = ast.Number('1')
+    for _ in range(10000):
+        node = ast.Statements([ast.Call('f', [node])])
+    node.set_parent(None)
+    leaf = list(node.walk())[-1]
+    assert leaf.value == '1'
+    assert leaf.root is node
+    assert leaf.parent.parent.parent is not None
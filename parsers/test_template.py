@@ -1,6 +1,11 @@
-from . import template
+import pytest
+
+from runtime import NameResolutionError, Runtime
+
+from . import scan, template
 from . import utils
 from .ast import template as ast
+from .ast.press_lang import resolve
 
 
 def parse(text):
@@ -34,6 +39,59 @@ def test_calls():
     assert inner_call.subject == 'Z'
 
 
+def dump(node):
+    if isinstance(node, list):
+        return [dump(el) for el in node]
+    if not hasattr(node, 'start'):
+        return node
+    fields = {
+        key: dump(value) for key, value in vars(node).items()
+        if key not in ('caller', 'parent', 'root', '_code', '_lines', '_prefix_lines')
+    }
+    return type(node).__name__, node.start, node.end, fields
+
+
+def test_scan():
+    for text in ('', '123', '[a]', 'x ] y[a]z', '123[blah[a1][a2]] tail',
+                 'a [f(1, "s")] b [g[x [h] y]]\n[c = 2; d]', '[]', '[a][b]'):
+        assert dump(scan.parse(text, actions=ast.Actions)) == dump(parse(text))
+    with pytest.raises(template.ParseError):
+        scan.parse('a [f(] b', actions=ast.Actions)
+
+
 # def test_strange():
 #     e = parse('[if (a) {]123[}]')
 #     utils.inspect(e)
+
+
+def test_source_location():
+    e = parse('one\ntwo [blah(1)] three\n[Z]')
+    e.file = 'doc.press'
+    e.text = 'one\ntwo [blah(1)] three\n[Z]'
+    e.prefix = 'intro\n--------\n'
+    e.set_parent(None)
+    call = e.elements[1].elements[0]
+    assert call.source_location() == ('doc.press', 4, 6)
+    assert call.source_line() == 'two [blah(1)'
+    last = e.elements[3].elements[0]
+    assert last.source_location() == ('doc.press', 5, 2)
+    assert e.source_location(0) == ('doc.press', 3, 1)
+
+
+def test_resolve_bracket_arguments():
+    runtime = Runtime()
+    runtime.set('greet', None)
+    e = parse('[greet[Hello [output(who)]]]')
+    e.set_parent(None)
+    resolve(e, runtime)
+    assert e.elements[1].elements[0].args[0].elements[1].elements[0].builtin
+    e = parse('Hello [output(who)]')
+    e.set_parent(None)
+    with pytest.raises(NameResolutionError):
+        resolve(e, runtime)
+
+    # names rebound by the intro
+    e = parse('[greet[[size(14)] x]]')
+    e.set_parent(None)
+    resolve(e, runtime, {'size'})
+    assert not e.elements[1].elements[0].args[0].elements[1].elements[0].builtin
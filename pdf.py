@@ -0,0 +1,22 @@
+def draw(canvas, pages, font):
+    # Replays a display list, one list of text operations per page, with
+    # the canvas calls the layout pass used to make directly
+    for index, ops in enumerate(pages):
+        if index:
+            canvas.showPage()
+            canvas.setFont(*font)
+        draw_page(canvas, ops)
+
+
+def draw_page(canvas, ops):
+    text = canvas.beginText()
+    calls = {
+        'origin': text.setTextOrigin,
+        'font': text.setFont,
+        'move': text.moveCursor,
+        'line': text.textLine,
+        'out': text.textOut,
+    }
+    for op in ops:
+        calls[op[0]](*op[1:])
+    canvas.drawText(text)
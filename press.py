@@ -1,19 +1,36 @@
+import argparse
+import io
+import os
 import re
 import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from doc import Document
+import tracing
+from doc import PROFILES, Document
+from parsers import scan, template
+from parsers.ast import press_lang as press_lang_ast
+from parsers.ast import template as template_ast
+from profiler import Profiler
 from runtime import PressError
 
 
-def main(file):
-    doc = Document(file)
+BORDER = re.compile('^-{20,}$', re.MULTILINE)
+PAGE_BREAK = re.compile(r'^[ \t]*\[pagebreak\][ \t]*$', re.MULTILINE)
+
+
+def read_source(file):
     input = open(file).read()
-    border = re.compile('^-{20,}$', re.MULTILINE)
-    if re.search(border, input):
-        intro, text = re.split(border, input, 1)
+    if re.search(BORDER, input):
+        intro, text = re.split(BORDER, input, 1)
     else:
         intro, text = "", input
-    doc.init(intro)
+    return intro, text
+
+
+def build(doc, text):
     try:
         doc.render(text)
     except PressError as e:
@@ -21,9 +38,254 @@ def main(file):
     doc.save()
 
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('Usage: {} <file>'.format(sys.argv[0]), file=sys.stderr)
-        print('  Missing required argument <file>', file=sys.stderr)
+def main(file, stream=False, output=None, pdf_profile='default'):
+    doc = Document(file, stream=stream, output=output, pdf_profile=pdf_profile)
+    intro, text = read_source(file)
+    doc.init(intro)
+    build(doc, text)
+
+
+def profile(file, stream=False, output=None, pdf_profile='default'):
+    profiler = Profiler()
+    profiler.install()
+    try:
+        main(file, stream=stream, output=output, pdf_profile=pdf_profile)
+    finally:
+        profiler.uninstall()
+    profiler.report(sys.stderr)
+    output = '{}.profile.json'.format(os.path.splitext(file)[0])
+    profiler.dump(output)
+    print('Profile written to {}'.format(output), file=sys.stderr)
+
+
+def page_breaks(text):
+    # Only insertions in the top level template start a new page, a
+    # [pagebreak] inside of a bracket argument is up to the function
+    try:
+        root = scan.parse(text, actions=template_ast.Actions)
+    except template.ParseError:
+        return set()
+    starts = set()
+    for part in root.elements:
+        if isinstance(part, press_lang_ast.Statements) and len(part.elements) == 1:
+            call = part.elements[0]
+            if isinstance(call, press_lang_ast.Call) and call.subject == 'pagebreak' \
+                    and not call.args:
+                starts.add(part.start)
+    return starts
+
+
+def split_chunks(text):
+    text = text.strip()
+    breaks = page_breaks(text)
+    chunks = []
+    start = 0
+    for match in PAGE_BREAK.finditer(text):
+        if not breaks.intersection(range(match.start(), match.end())):
+            continue
+        chunks.append((start, match.start()))
+        start = match.end()
+    chunks.append((start, len(text)))
+    result = []
+    for start, end in chunks:
+        chunk = text[start:end]
+        if chunk.strip():
+            start += len(chunk) - len(chunk.lstrip())
+            result.append((text[:start], chunk))
+    return result
+
+
+def render_chunk(file, intro, prefix, text, output, stream=False, pdf_profile='default'):
+    doc = Document(file, stream=stream, output=output, prefix=prefix, pdf_profile=pdf_profile)
+    doc.init(intro)
+    try:
+        doc.run_prefix()
+    except PressError:
+        # reported by the chunk it happened in, a serial run stops there
+        doc.save()
+        return
+    build(doc, text)
+
+
+def parallel(file, jobs, stream=False, output=None, pdf_profile='default'):
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        print('--jobs requires pypdf to merge the rendered chunks', file=sys.stderr)
         sys.exit(1)
-    main(sys.argv[1])
+
+    intro, text = read_source(file)
+    chunks = split_chunks(text)
+    with tempfile.TemporaryDirectory() as tmp, ProcessPoolExecutor(jobs) as pool:
+        outputs = [os.path.join(tmp, '{}.pdf'.format(idx)) for idx in range(len(chunks))]
+        futures = [
+            pool.submit(render_chunk, file, intro, prefix, chunk, chunk_output, stream, pdf_profile)
+            for (prefix, chunk), chunk_output in zip(chunks, outputs)
+        ]
+        for future in futures:
+            future.result()
+
+        writer = PdfWriter()
+        for chunk_output in outputs:
+            writer.append(chunk_output)
+        writer.add_metadata({'/Creator': 'press', '/Producer': ''})
+        writer.write(output or '{}.pdf'.format(os.path.splitext(file)[0]))
+
+
+def render_document(file, stream=False, pdf_profile='default'):
+    started = time.perf_counter()
+    error = None
+    try:
+        doc = Document(file, stream=stream, pdf_profile=pdf_profile)
+        intro, text = read_source(file)
+        doc.init(intro)
+        try:
+            doc.render(text)
+        finally:
+            doc.save()
+    except PressError as e:
+        out = io.StringIO()
+        e.report(out)
+        error = out.getvalue()
+    except Exception:
+        error = traceback.format_exc()
+    return time.perf_counter() - started, error
+
+
+def read_manifest(manifest):
+    files = []
+    base = os.path.dirname(manifest)
+    for line in open(manifest):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            files.append(os.path.join(base, line))
+    return files
+
+
+def batch(files, workers=None, stream=False, pdf_profile='default'):
+    started = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(render_document, file, stream, pdf_profile): file for file in files}
+        for future in as_completed(futures):
+            file = futures[future]
+            try:
+                elapsed, error = future.result()
+            except Exception:
+                elapsed, error = 0, traceback.format_exc()
+            if error is None:
+                print('ok      {:8.2f}s  {}'.format(elapsed, file))
+            else:
+                failed += 1
+                print('FAILED  {:8.2f}s  {}'.format(elapsed, file))
+                print(error, file=sys.stderr)
+    print('{} documents, {} failed in {:.2f}s'.format(
+        len(files), failed, time.perf_counter() - started
+    ))
+    return failed
+
+
+def watch(file, interval=0.5, stream=False, output=None, pdf_profile='default'):
+    doc = Document(file, stream=stream, output=output, pdf_profile=pdf_profile)
+    mtime = None
+    while True:
+        try:
+            current = os.stat(file).st_mtime
+        except FileNotFoundError:
+            # editors often replace the file on save
+            current = None
+        if current is not None and current != mtime:
+            mtime = current
+            started = time.perf_counter()
+            try:
+                if doc.runtime is not None:
+                    doc.init_canvas(file)
+                intro, text = read_source(file)
+                if doc.snapshot is None or intro.strip() != doc.intro:
+                    doc.init(intro)
+                else:
+                    doc.reset()
+                build(doc, text)
+            except PressError as e:
+                e.report()
+            except Exception:
+                traceback.print_exc()
+            else:
+                print('Rebuilt {} in {:.2f}s'.format(
+                    file, time.perf_counter() - started
+                ), file=sys.stderr)
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', metavar='file', nargs='*')
+    parser.add_argument('--watch', action='store_true',
+                        help='rebuild the PDF every time <file> changes')
+    parser.add_argument('--stream', action='store_true',
+                        help='lay out fragments as they are produced instead of '
+                             'collecting the whole document first')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='render the chunks between [pagebreak] lines in '
+                             'this many processes')
+    parser.add_argument('--manifest', action='append', default=[],
+                        help='file listing documents to render, one per line')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes used to render many documents '
+                             '(default: one per CPU)')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='where the PDF goes, - for stdout (default: <file>.pdf)')
+    parser.add_argument('--pdf-profile', choices=list(PROFILES), default='default',
+                        help='fast skips stream compression, small compresses '
+                             'and stores streams as binary')
+    parser.add_argument('--trace', metavar='CHANNELS',
+                        help='comma separated channels to trace: {} or all'.format(
+                            ', '.join(tracing.CHANNELS)))
+    parser.add_argument('--trace-file', metavar='FILE',
+                        help='where trace events go (default: <file>.trace.jsonl)')
+    parser.add_argument('--profile', action='store_true',
+                        help='report time per phase and per function, and '
+                             'write it to <file>.profile.json')
+    args = parser.parse_args()
+    files = list(args.files)
+    for manifest in args.manifest:
+        files.extend(read_manifest(manifest))
+    if not files:
+        parser.error('Missing required argument <file>')
+
+    if args.trace:
+        if len(files) > 1 or args.manifest or args.jobs > 1:
+            parser.error('--trace takes a single <file> and cannot be combined with --jobs')
+        channels = tracing.CHANNELS if args.trace == 'all' else args.trace.split(',')
+        try:
+            tracing.enable(channels, args.trace_file or '{}.trace.jsonl'.format(
+                os.path.splitext(files[0])[0]
+            ))
+        except ValueError as e:
+            parser.error(str(e))
+
+    output = args.output
+    if output == '-':
+        output = sys.stdout.buffer
+
+    if len(files) > 1 or args.manifest:
+        if args.watch or args.jobs > 1 or args.profile or args.output:
+            parser.error('--watch, --jobs, --profile and --output take a single <file>')
+        sys.exit(1 if batch(files, args.workers, stream=args.stream,
+                            pdf_profile=args.pdf_profile) else 0)
+    elif args.profile:
+        if args.watch or args.jobs > 1:
+            parser.error('--profile cannot be combined with --watch or --jobs')
+        profile(files[0], stream=args.stream, output=output, pdf_profile=args.pdf_profile)
+    elif args.watch:
+        if args.output == '-':
+            parser.error('--watch cannot write to stdout')
+        try:
+            watch(files[0], stream=args.stream, output=args.output, pdf_profile=args.pdf_profile)
+        except KeyboardInterrupt:
+            pass
+    elif args.jobs > 1:
+        parallel(files[0], args.jobs, stream=args.stream, output=output,
+                 pdf_profile=args.pdf_profile)
+    else:
+        main(files[0], stream=args.stream, output=output, pdf_profile=args.pdf_profile)
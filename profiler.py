@@ -0,0 +1,103 @@
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+PHASES = ('intro parse', 'intro execute', 'body parse', 'body execute', 'layout', 'draw', 'save')
+
+# The profiler of the running document, see `Profiler.install`
+current = None
+
+
+def phase(name):
+    if current is None:
+        return nullcontext()
+    return current.phase(name)
+
+
+class Profiler:
+    def __init__(self):
+        self.phases = defaultdict(float)
+        # time spent in nested phases, subtracted from the enclosing one
+        self.nested = []
+        # (name, file, line) -> [calls, cumulative seconds]
+        self.calls = defaultdict(lambda: [0, 0.0])
+        self.depth = defaultdict(int)
+
+    def install(self):
+        global current
+        current = self
+
+    def uninstall(self):
+        global current
+        current = None
+
+    @contextmanager
+    def phase(self, name):
+        self.nested.append(0.0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.phases[name] += elapsed - self.nested.pop()
+            if self.nested:
+                self.nested[-1] += elapsed
+
+    def timed(self, name, func):
+        @wraps(func)
+        def timed(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return timed
+
+    def call(self, node, func):
+        # Wraps a compiled call, recursive calls only count once towards
+        # the cumulative time
+        file, line, _ = node.source_location()
+        key = (node.subject, file, line)
+        stats = self.calls[key]
+        depth = self.depth
+
+        @wraps(func)
+        def call(runtime, caller):
+            stats[0] += 1
+            depth[key] += 1
+            started = time.perf_counter()
+            try:
+                return func(runtime, caller)
+            finally:
+                depth[key] -= 1
+                if not depth[key]:
+                    stats[1] += time.perf_counter() - started
+        return call
+
+    def results(self):
+        phases = {name: self.phases[name] for name in PHASES if name in self.phases}
+        phases.update(self.phases)
+        calls = [
+            {'name': name, 'file': file, 'line': line, 'calls': count, 'cumulative': cumulative}
+            for (name, file, line), (count, cumulative) in self.calls.items()
+        ]
+        calls.sort(key=lambda row: row['cumulative'], reverse=True)
+        return {'phases': phases, 'total': sum(phases.values()), 'calls': calls}
+
+    def report(self, out, limit=30):
+        results = self.results()
+        total = results['total'] or 1
+        print('{:<16} {:>10} {:>7}'.format('phase', 'seconds', '%'), file=out)
+        for name, elapsed in results['phases'].items():
+            print('{:<16} {:>10.4f} {:>6.1f}%'.format(name, elapsed, 100 * elapsed / total), file=out)
+        print('{:<16} {:>10.4f}'.format('total', results['total']), file=out)
+        print(file=out)
+        print('{:>8} {:>10} {:>10}  {}'.format('calls', 'cumtime', 'percall', 'function'), file=out)
+        for row in results['calls'][:limit]:
+            print('{:>8} {:>10.4f} {:>10.6f}  {} ({}, line {})'.format(
+                row['calls'], row['cumulative'], row['cumulative'] / row['calls'],
+                row['name'], row['file'], row['line']
+            ), file=out)
+
+    def dump(self, file):
+        with open(file, 'w') as f:
+            json.dump(self.results(), f, indent=2)
@@ -1,11 +1,12 @@
 import inspect
+import linecache
 import sys
 from collections import defaultdict
 from copy import copy
 from functools import wraps
 from typing import Callable
 
-from text_fragment import State, TextFragment, TextLine
+from text_fragment import PageBreak, State, TextFragment, TextLine
 
 
 def register(func: Callable[..., None]) -> Callable[..., None]:
@@ -21,42 +22,29 @@ class PressError(Exception):
         super().__init__(*args, **kwargs)
         self.node = node
 
-    def report(self):
-        print('Traceback:', file=sys.stderr)
+    def report(self, out=None):
+        if out is None:
+            out = sys.stderr
+        print('Traceback:', file=out)
         stacktrace = self.stacktrace()
         for item in stacktrace[:-1]:
-            print('  {}, line {}'.format(item['file'], item['line_no']), file=sys.stderr)
-            print('    {}'.format(item['line']), file=sys.stderr)
-        print('{}: {}'.format(self.__class__.__name__, self.args[0]), file=sys.stderr)
+            print('  {}, line {}'.format(item['file'], item['line_no']), file=out)
+            print('    {}'.format(item['line']), file=out)
+        print('{}: {}'.format(self.__class__.__name__, self.args[0]), file=out)
 
-        prog = self.node.root.text[:self.node.end] # type: str
-        prev = prog[:self.node.start].rfind('\n')
-        print('  {}'.format(stacktrace[-1]['line']), file=sys.stderr)
-        print('  {}^'.format('-' * (self.node.start - prev - 1)), file=sys.stderr)
-        print('  {}, line {}'.format(stacktrace[-1]['file'], stacktrace[-1]['line_no']), file=sys.stderr)
+        file, line_no, column = self.node.source_location()
+        print('  {}'.format(stacktrace[-1]['line']), file=out)
+        print('  {}^'.format('-' * (column - 1)), file=out)
+        print('  {}, line {}'.format(file, line_no), file=out)
 
     def stacktrace(self):
         from parsers.ast.press_lang import Call
 
-        prog = self.node.root.text[:self.node.end + 1] # type: str
-        prev = prog[:self.node.start].rfind('\n')
-        next = prog.find('\n', self.node.start)
-        result = [{
-            'file': self.node.root.file,
-            'line_no': 1 + self.node.root.text[:self.node.start].count('\n') + self.node.root.prefix_lines,
-            'line': prog[prev + 1:next]
-        }]
+        result = [self.frame(self.node)]
         caller = self.node.caller
         while caller is not None:
             if isinstance(caller, Call):
-                prog = caller.root.text[:caller.end + 1] # type: str
-                prev = prog[:caller.start].rfind('\n')
-                next = prog.find('\n', caller.start)
-                result.append({
-                    'file': caller.root.file,
-                    'line_no': 1 + caller.root.text[:caller.start].count('\n') + caller.root.prefix_lines,
-                    'line': prog[prev + 1:next]
-                })
+                result.append(self.frame(caller))
             elif isinstance(caller, PythonCall):
                 result.append({
                     'file': caller.file,
@@ -68,6 +56,15 @@ class PressError(Exception):
         result.reverse()
         return result
 
+    @staticmethod
+    def frame(node):
+        file, line_no, _ = node.source_location()
+        return {
+            'file': file,
+            'line_no': line_no,
+            'line': node.source_line()
+        }
+
 
 class NameResolutionError(PressError):
 
@@ -82,23 +79,57 @@ class Runtime:
         # noinspection PyUnresolvedReferences
         import runtime_funcs
         self.stack = [{}]
+        self.builtins = {}
         self.load_registry()
         self.state = State()
         self.items = []
+        self.sink = None
+        self.after_break = False
         self.newlines_active = True
         self.column_state = None
 
     def load_registry(self):
         for name, func in self.registry.items():
-            self.set(name, self.decorate(func))
+            self.builtins[name] = self.decorate(func)
+            self.set(name, self.builtins[name])
+
+    def snapshot(self):
+        return [dict(frame) for frame in self.stack], copy(self.state), self.newlines_active
+
+    def restore(self, snapshot):
+        stack, state, self.newlines_active = snapshot
+        self.stack = [dict(frame) for frame in stack]
+        self.state = copy(state)
+        self.items = []
+        self.after_break = False
+        self.column_state = None
+
+    def emit(self, item):
+        # Fragments reaching the top level template go straight to the sink
+        # when streaming, nested templates still collect theirs for the caller
+        if self.sink is not None and len(self.items) == 1:
+            self.sink(item)
+        else:
+            self.items[-1].append(item)
+
+    def add_page_break(self):
+        self.emit(PageBreak())
+        self.after_break = True
 
     def add_text(self, text):
+        if self.after_break:
+            # the newline ending a `[pagebreak]` line belongs to the break
+            self.after_break = False
+            if text.startswith('\n'):
+                text = text[1:]
+                if not text:
+                    return
         if self.newlines_active:
-            self.items[-1].append(TextFragment(text, copy(self.state)))
+            self.emit(TextFragment(text, self.state.freeze()))
             self.state.reset()
 
     def add_line(self, text):
-        self.items[-1].append(TextLine(text, copy(self.state)))
+        self.emit(TextLine(text, self.state.freeze()))
         self.state.reset()
 
     def push_buffer(self):
@@ -146,7 +177,16 @@ class Runtime:
 class PythonCall:
     def __init__(self, caller):
         self.caller = caller
-        frame = inspect.stack()[1]
-        self.file = frame.filename
-        self.line_no = frame.lineno
-        self.line = frame.code_context[frame.index]
+        # Only the code object and line are kept, the rest is looked up
+        # when an error is reported
+        frame = sys._getframe(1)
+        self.code = frame.f_code
+        self.line_no = frame.f_lineno
+
+    @property
+    def file(self):
+        return self.code.co_filename
+
+    @property
+    def line(self):
+        return linecache.getline(self.file, self.line_no)
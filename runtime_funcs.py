@@ -1,27 +1,15 @@
 from copy import copy
 
-from reportlab.lib.fonts import tt2ps, addMapping
+from reportlab.lib.fonts import tt2ps
 from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 
+import fonts
+from linebreak import ENGINES
 from parsers.ast.press_lang import prepare_arg
 from runtime import Runtime, register, PythonCall
 from text_fragment import TextLine
 
 
-def reportlab_mapping(font: TTFont):
-    family_name = font.face.familyName.decode('utf-8')
-    full_name = font.face.name.decode('utf-8')
-    if type(font.face.styleName) is bytes:
-        style_name = font.face.styleName.decode('utf-8')
-    else:
-        style_name = font.face.styleName
-    style_name = style_name.lower()
-    bold = int('bold' in style_name)
-    italic = int('italic' in style_name)
-    addMapping(family_name, bold, italic, full_name)
-
-
 @register
 def size(runtime: Runtime, size, leading=None):
     runtime.state.set_font_size(size, leading)
@@ -29,23 +17,14 @@ def size(runtime: Runtime, size, leading=None):
 
 @register
 def font(runtime, fontname, fontsize, leading=None, file=None):
-    if file is None:
-        file = f"{fontname}.ttf"
+    fonts.ensure(fontname)
     if fontname not in pdfmetrics._fonts and not fontname in pdfmetrics.standardFonts:
         try:
-            font = TTFont(fontname, file)
-        except:
-            if file is None:
-                file = f"{fontname}.ttc"
-            font = TTFont(fontname, file)
-        pdfmetrics.registerFont(font)
-        reportlab_mapping(font)
-        if font.face.fileKind == 'TTC':
-            for idx, _ in enumerate(font.face.subfontOffsets[1:]):
-                tt_font = TTFont(fontname, file, subfontIndex=idx + 1)
-                tt_font.fontName = tt_font.face.name.decode('utf-8')
-                pdfmetrics.registerFont(tt_font)
-                reportlab_mapping(tt_font)
+            fonts.register(fontname, file or f"{fontname}.ttf")
+        except Exception:
+            if file is not None:
+                raise
+            fonts.register(fontname, f"{fontname}.ttc")
 
     if leading is not None:
         leading = float(leading)
@@ -59,19 +38,19 @@ def indent(runtime, length):
 
 @register
 def set_state(runtime, el):
-    runtime.state = el
+    runtime.state = copy(el)
 
 
 @register
 def get_state(runtime):
-    return copy(runtime.state)
+    return runtime.state.freeze()
 
 
 @register
 def output(runtime, el):
     if type(el) == list:
         for item in el:
-            runtime.items[-1].append(item)
+            runtime.emit(item)
     else:
         runtime.add_text(el)
 
@@ -84,11 +63,16 @@ def line(runtime, el):
         for item in el:
             if not isinstance(item, TextLine):
                 item = TextLine(item.text, item.state)
-            runtime.items[-1].append(item)
+            runtime.emit(item)
     else:
         runtime.add_line(el)
 
 
+@register
+def pagebreak(runtime):
+    runtime.add_page_break()
+
+
 @register
 def get(runtime, el):
     return runtime.get(el)
@@ -113,10 +97,20 @@ def column(runtime, column):
     runtime.state.set_column(column)
 
 
+@register
+def linebreak(runtime, engine):
+    if engine not in ENGINES:
+        raise ValueError('Unknown line breaking engine `{}`, expected one of: {}'.format(
+            engine, ', '.join(ENGINES)
+        ))
+    runtime.state.set_linebreak(engine)
+
+
 @register
 def i(runtime, el, caller=None):
     fontname = runtime.state.font
     italic = tt2ps(fontname, 0, 1)
+    fonts.ensure(italic)
     runtime.state.font = italic
     output(runtime, prepare_arg(PythonCall(caller), runtime, el))
     runtime.state.font = fontname
@@ -0,0 +1,23 @@
+import random
+
+import pytest
+
+import linebreak
+
+
+def test_greedy_array():
+    np = pytest.importorskip('numpy')
+    rng = random.Random(0)
+    for _ in range(5000):
+        widths = [rng.choice((0, 0.1, 0.2, 0.3, 0.7, 3.3)) * rng.choice((1, 3.7))
+                  for _ in range(rng.randint(0, 40))]
+        space = rng.choice((0, 0.1, 0.25, 1 / 3))
+        # line ends exactly at the width are where rounding shows
+        used = 0
+        ends = [1.0]
+        for w in widths:
+            used += w + space
+            ends += [used, used - space]
+        width = rng.choice(ends)
+        expected = linebreak.greedy(widths, space, width)
+        assert linebreak.greedy(np.array(widths, dtype=float), space, width) == expected
@@ -0,0 +1,34 @@
+import pytest
+
+from text_fragment import State
+
+
+def test_state_freeze():
+    state = State()
+    frozen = state.freeze()
+    assert state.freeze() is frozen
+    with pytest.raises(AttributeError):
+        frozen.font_size = 10
+    state.set_font_size(10)
+    assert state.freeze() is not frozen
+    assert frozen.font_size == 12
+    other = State()
+    other.set_font_size(10)
+    assert other.freeze() is state.freeze()
+
+
+def test_state_key_types():
+    state, other = State(), State()
+    state.set_font_size(12)
+    other.set_font_size(12.0)
+    assert state.key() != other.key()
+    state.set_margin(1)
+    other.set_font_size(12)
+    other.set_margin(True)
+    assert state.freeze() is not other.freeze()
+
+    state.set_columns([{'width': 200}, {}])
+    other.set_columns([{'width': 200.0}, {}])
+    assert state.key() != other.key()
+    assert state.widths[0] == 200
+    assert other.widths[0] == other.widths[1]
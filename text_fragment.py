@@ -1,18 +1,54 @@
+from copy import copy
+from functools import lru_cache
+from weakref import WeakValueDictionary
+
 import reportlab.lib
 from reportlab.lib.units import cm
-from reportlab.pdfbase.pdfmetrics import stringWidth as text_width
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.pdfgen.textobject import PDFTextObject
 
+import linebreak
+import measure
+import paragraphs
+import tracing
+
+
+@lru_cache(maxsize=64 * 1024)
+def text_width(font, size, text):
+    return stringWidth(text, font, size)
+
+
+def _hashable(value):
+    # Scalars keep their type, 200 and 200.0 or 1 and true are different
+    # settings (only int column widths are fixed)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+    return type(value), value
+
 
 class State:
     DEFAULT_LEADING = 1.0
     DEFAULT_COLUMN_GAP = 10
 
+    __slots__ = (
+        'font', 'font_size', 'page_size_name', 'margins', 'leading', 'page_size',
+        'indent', 'margin', 'column_gap', 'columns_reset', 'columns', 'column',
+        'linebreak', 'widths', 'offsets', 'right_aligned', '_columns_key',
+        '_frozen', '__weakref__',
+    )
+    # Frozen states shared between fragments, see `freeze`
+    _interned = WeakValueDictionary()
+    # Column geometry per page width, gap and column specs
+    _geometry = {}
+
     def __init__(self):
+        object.__setattr__(self, '_frozen', None)
         self.font = 'Tahoma'
         self.font_size = 12
         self.page_size_name = 'A4'
-        self.margins = [1.5 * cm, 2 * cm]
+        self.margins = (1.5 * cm, 2 * cm)
         self.leading = self.DEFAULT_LEADING
         self.page_size = getattr(reportlab.lib.pagesizes, self.page_size_name)
         self.indent = 0
@@ -21,13 +57,50 @@ class State:
         self.column_gap = self.DEFAULT_COLUMN_GAP
         self.columns_reset = False
         self.columns = []
+        self._columns_key = ()
         self.column = 1
 
+        self.linebreak = 'greedy'
+
         self.calculate_widths()
 
+    def __setattr__(self, name, value):
+        if self._frozen is self:
+            raise AttributeError('State is frozen, copy it to make changes')
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, '_frozen', None)
+
+    def __copy__(self):
+        state = State.__new__(State)
+        object.__setattr__(state, '_frozen', None)
+        for name in self.__slots__[:-2]:
+            object.__setattr__(state, name, getattr(self, name))
+        return state
+
+    def key(self):
+        return _hashable((
+            self.font, self.font_size, self.page_size_name, self.margins,
+            self.leading, self.indent, self.margin, self.column_gap,
+            self.columns_reset, self.column, self.linebreak,
+        )) + (self._columns_key,)
+
+    def freeze(self):
+        # Copy-on-write: the frozen copy is reused until a setting changes
+        if self._frozen is None:
+            key = self.key()
+            state = self._interned.get(key)
+            if state is None:
+                state = copy(self)
+                object.__setattr__(state, '_frozen', state)
+                self._interned[key] = state
+            object.__setattr__(self, '_frozen', state)
+        return self._frozen
+
     def reset(self):
-        self.margin = 0
-        self.columns_reset = False
+        if self.margin:
+            self.margin = 0
+        if self.columns_reset:
+            self.columns_reset = False
 
     def set_font(self, font, size, leading=None):
         self.font = font
@@ -50,16 +123,34 @@ class State:
     def set_columns(self, specs):
         self.columns_reset = True
         self.columns = specs
+        self._columns_key = _hashable(specs)
         self.calculate_widths()
 
     def set_column(self, column):
         self.column = column
 
+    def set_linebreak(self, engine):
+        self.linebreak = engine
+
     def calculate_widths(self):
+        # widths and x offsets of the columns, and which ones align right;
+        # offsets[n] is where column n + 1 starts, offsets[-1] the sum of all
         page_width = self.page_size[0] - 2 * self.margins[0]
+        key = (_hashable(page_width), _hashable(self.column_gap), self._columns_key)
+        if key not in self._geometry:
+            widths = self._calculate_widths(page_width)
+            offsets = [0]
+            for col in range(len(self.columns)):
+                offsets.append(offsets[-1] + (widths[col] + self.column_gap))
+            right_aligned = [False]
+            if len(self.columns) > 1:
+                right_aligned = [spec.get('align') == 'right' for spec in self.columns]
+            self._geometry[key] = widths, tuple(offsets), tuple(right_aligned)
+        self.widths, self.offsets, self.right_aligned = self._geometry[key]
+
+    def _calculate_widths(self, page_width):
         if not self.columns or len(self.columns) == 1:
-            self.widths = {0: page_width}
-            return
+            return {0: page_width}
         remaining_width = page_width - self.column_gap * (len(self.columns) - 1)
         unspec_cols = 0
         widths = {}
@@ -73,10 +164,12 @@ class State:
         for col, _ in enumerate(self.columns):
             if col not in widths:
                 widths[col] = remaining_width / unspec_cols
-        self.widths = widths
+        return widths
 
 
 class TextFragment:
+    __slots__ = ('text', 'state')
+
     def __init__(self, text, state):
         self.text = text
         self.state = state
@@ -108,33 +201,42 @@ class TextFragment:
                 if prev_col and prev_col != state.column:
                     prev_y = runtime.column_state[prev_col]
                 prev_x = 0
-                my_x = 0
                 if prev_col:
-                    for col in range(len(state.columns)):
-                        if col + 1 < prev_col:
-                            prev_x += state.widths[col] + state.column_gap
+                    prev_x = state.offsets[min(prev_col - 1, len(state.columns))]
 
                 if state.columns_reset:
                     prev_x  = runtime.column_state.get('prev_x', 0)
                     runtime._reset_columns()
                     prev_y = 0
 
-                for col in range(len(state.columns)):
-                    if col + 1 < state.column:
-                        my_x += state.widths[col] + state.column_gap
-                if not self.text.startswith(' for predicting cell types in Mouse Cell Atlas'):
-                    print("Moving column {} {}; {}".format(my_x - prev_x, -prev_y, repr(self.text)))
-                    text.moveCursor(my_x - prev_x, -prev_y)
+                my_x = state.offsets[min(state.column - 1, len(state.columns))]
+                if tracing.column:
+                    tracing.event(
+                        'column', 'move', column=state.column, previous=prev_col,
+                        dx=my_x - prev_x, dy=-prev_y, text=self.text
+                    )
+                text.moveCursor(my_x - prev_x, -prev_y)
                 runtime.column_state['previous'] = state.column
                 runtime.column_state['prev_x'] = my_x
                 runtime.column_state[state.column] = (len(self.lines())) * state.font_size * state.leading
             if state.margin:
                 text.moveCursor(0, state.margin)
 
-        text.setFont(state.font, state.font_size, state.font_size * state.leading)
+        font = (state.font, state.font_size, state.font_size * state.leading)
+        if getattr(text, '_press_font', None) != font:
+            text.setFont(*font)
+            text._press_font = font
         indent = state.indent - getattr(text, '_indent', 0)
         text._indent = state.indent
-        text.setXPos(indent)
+        if indent:
+            text.setXPos(indent)
+
+    def mergeable(self, other):
+        # Adjacent plain fragments sharing an interned state lay out exactly
+        # like one, unless they move the cursor on their own
+        return type(self) is TextFragment and type(other) is TextFragment \
+            and self.state is other.state \
+            and not self.state.columns and not self.state.margin
 
     def set_text_origin(self, text: PDFTextObject):
         text.setTextOrigin(
@@ -143,46 +245,48 @@ class TextFragment:
         )
 
     def text_width(self, text):
-        return text_width(text, self.state.font, self.state.font_size)
+        return text_width(self.state.font, self.state.font_size, text)
+
+    def word_widths(self, words):
+        if len(words) >= measure.MIN_WORDS:
+            widths = measure.word_widths(self.state.font, self.state.font_size, words)
+            if widths is not None:
+                return widths
+        return [self.text_width(word) for word in words]
 
     def lines(self):
+        state = self.state
+        return paragraphs.lines(
+            self.text, state.font, state.font_size, self.width, state.linebreak,
+            self._break_lines
+        )
+
+    def _break_lines(self):
         width = self.width
         space_width = self.text_width(' ')
+        engine = linebreak.ENGINES[self.state.linebreak]
         result = []
         for line in self.text.split('\n'):
-            line_words = []
-            used_width = 0
-            for word in line.split(' '):
-                wwidth = self.text_width(word)
-                # print((width, used_width, wwidth, repr(word)))
-                if not used_width or used_width + wwidth < width:
-                    line_words.append(word)
-                    used_width += wwidth + space_width
-                else:
-                    result.append(' '.join(line_words))
-                    line_words = [word]
-                    used_width = wwidth
-            if line_words:
-                result.append(' '.join(line_words))
+            words = line.split(' ')
+            widths = self.word_widths(words)
+            for start, end in engine(widths, space_width, width):
+                result.append(' '.join(words[start:end]))
         if not result and len(self.text) > 0:
             result.append('')
         return result
 
     def text_line(self, text: PDFTextObject, line, final=False):
         state = self.state
-        if len(state.columns) > 1 \
-                and 'align' in state.columns[state.column - 1] \
-                and state.columns[state.column - 1]['align'] == 'right':
-            text.setXPos(state.widths[state.column - 1] - self.text_width(line))
-            # print(state.widths[state.column - 1] - self.text_width(line))
+        right_aligned = state.right_aligned[state.column - 1]
+        if right_aligned:
+            width = self.text_width(line)
+            text.setXPos(state.widths[state.column - 1] - width)
         if final and not isinstance(self, TextLine):
             text.textOut(line)
         else:
             text.textLine(line)
-        if len(state.columns) > 1 \
-                and 'align' in state.columns[state.column - 1] \
-                and state.columns[state.column - 1]['align'] == 'right':
-            text.setXPos(-state.widths[state.column - 1] + self.text_width(line))
+        if right_aligned:
+            text.setXPos(-state.widths[state.column - 1] + width)
 
         # if isinstance(item, TextLine):
         #     txt.textLine(item.text)
@@ -194,8 +298,45 @@ class TextFragment:
 
 
 class TextLine(TextFragment):
+    __slots__ = ()
+
     def __init__(self, text, state):
         super().__init__(text, state)
 
     def lines(self):
         return [self.text]
+
+
+class PageBreak:
+    __slots__ = ()
+
+    def __repr__(self):
+        return '<{}>'.format(self.__class__.__name__)
+
+
+class Coalescer:
+    def __init__(self, sink):
+        self.sink = sink
+        self.pending = None
+        self.parts = []
+
+    def add(self, item):
+        if self.pending is not None and self.pending.mergeable(item):
+            self.parts.append(item.text)
+            return
+        self.flush()
+        if isinstance(item, TextFragment):
+            self.pending = item
+            self.parts = [item.text]
+        else:
+            self.sink(item)
+
+    def flush(self):
+        if self.pending is None:
+            return
+        item = self.pending
+        if len(self.parts) > 1:
+            item = TextFragment(''.join(self.parts), item.state)
+        self.pending = None
+        self.parts = []
+        self.sink(item)
@@ -0,0 +1,54 @@
+import atexit
+import json
+import time
+
+CHANNELS = ('parse', 'execute', 'layout', 'column', 'page')
+
+# One flag per channel, call sites check it before building an event:
+#     if tracing.column:
+#         tracing.event('column', 'move', dx=dx, dy=dy)
+parse = execute = layout = column = page = False
+
+_out = None
+_started = 0.0
+
+
+def enable(channels, file):
+    global _out, _started
+    unknown = set(channels) - set(CHANNELS)
+    if unknown:
+        raise ValueError('Unknown trace channels: {}, expected some of: {}'.format(
+            ', '.join(sorted(unknown)), ', '.join(CHANNELS)
+        ))
+    disable()
+    _out = open(file, 'w')
+    atexit.register(disable)
+    _started = time.perf_counter()
+    for channel in channels:
+        globals()[channel] = True
+
+
+def disable():
+    global _out
+    for channel in CHANNELS:
+        globals()[channel] = False
+    if _out is not None:
+        _out.close()
+        _out = None
+
+
+def event(channel, name, /, **fields):
+    record = {'t': round(time.perf_counter() - _started, 6), 'channel': channel, 'event': name}
+    record.update(fields)
+    _out.write(json.dumps(record, default=repr))
+    _out.write('\n')
+
+
+def call(node, func):
+    # Wraps a compiled call, only done while the execute channel is on
+    file, line, _ = node.source_location()
+
+    def call(runtime, caller):
+        event('execute', 'call', name=node.subject, file=file, line=line)
+        return func(runtime, caller)
+    return call